@@ -0,0 +1,57 @@
+import javax.tools.*;
+import java.io.*;
+import java.nio.file.*;
+import java.util.*;
+import java.util.stream.*;
+
+/**
+ * Helper for grader.py: compiles many independent student projects inside one
+ * JVM so we pay javac's startup cost once per run instead of once per project.
+ *
+ * Protocol: one work item per stdin line, "srcRoot\tbuildDir". For each item
+ * all .java sources under srcRoot are compiled into buildDir via the
+ * javax.tools API, the compiler output is written to buildDir/compile.log,
+ * and one status line "OK\tsrcRoot" or "FAIL\tsrcRoot" is printed to stdout.
+ */
+public class BulkCompile {
+    public static void main(String[] args) throws IOException {
+        JavaCompiler compiler = ToolProvider.getSystemJavaCompiler();
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in));
+        String line;
+        while ((line = in.readLine()) != null) {
+            String[] parts = line.split("\t");
+            if (parts.length != 2) continue;
+            Path srcRoot = Paths.get(parts[0]);
+            Path buildDir = Paths.get(parts[1]);
+            boolean ok = false;
+            StringWriter log = new StringWriter();
+            try {
+                Files.createDirectories(buildDir);
+                List<File> sources;
+                try (Stream<Path> walk = Files.walk(srcRoot)) {
+                    sources = walk.filter(p -> p.toString().endsWith(".java"))
+                                  .map(Path::toFile)
+                                  .collect(Collectors.toList());
+                }
+                if (sources.isEmpty()) {
+                    log.write("No .java sources under " + srcRoot);
+                } else {
+                    StandardJavaFileManager fm = compiler.getStandardFileManager(null, null, null);
+                    fm.setLocation(StandardLocation.CLASS_OUTPUT, List.of(buildDir.toFile()));
+                    ok = compiler.getTask(new PrintWriter(log), fm, null,
+                                          List.of("-encoding", "UTF-8"), null,
+                                          fm.getJavaFileObjectsFromFiles(sources)).call();
+                    fm.close();
+                }
+            } catch (Exception e) {
+                log.write(e.toString());
+            }
+            try {
+                Files.writeString(buildDir.resolve("compile.log"), log.toString());
+            } catch (IOException ignored) {
+            }
+            System.out.println((ok ? "OK" : "FAIL") + "\t" + parts[0]);
+            System.out.flush();
+        }
+    }
+}
@@ -18,17 +18,48 @@ python grader.py --folderPath /Test2/projects --projDescription /Test2/desc.txt
 
 import argparse, os, json, sys, pprint
 import subprocess, shutil, re, time
+import asyncio, functools, hashlib, selectors, threading
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import orjson
 from google import genai
 
-# Create key
-with open("keys.json", "r") as f:
-    key = json.load(f)["key1"]
-client = genai.Client(api_key=key)
-
-# Read prompt instructions from file
-with open("prompt_instructions.txt", "r") as f:
-    prompt_instructions = f.read()
+# Cap on concurrent Gemini calls so we don't trip API rate limits
+AI_CONCURRENCY = 16
+# How many submissions to pack into one Gemini request; the shared prompt
+# prefix (instructions/description/expected output) is then billed once per
+# batch instead of once per student
+AI_BATCH_SIZE = 5
+# Budget for the concatenated code sent to the AI; trim_length would throw
+# away anything past ~20k chars anyway, so don't bother collecting much more
+CODE_BYTE_BUDGET = 64_000
+# Per-stream cap on student program output; a child that prints more than
+# this gets killed instead of filling our memory
+RUN_OUTPUT_CAP = 64_000
+
+# CPUs actually available to us: sched_getaffinity respects cgroup/container
+# limits where cpu_count reports the whole machine (not on every platform)
+def available_cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+# Lazily build the genai client once per process (workers pay this once, not per call)
+def _get_client():
+    if not hasattr(_get_client, "_client"):
+        with open("keys.json", "r") as f:
+            key = json.load(f)["key1"]
+        _get_client._client = genai.Client(api_key=key)
+    return _get_client._client
+
+# Lazily read prompt instructions once per process
+def _get_prompt_instructions() -> str:
+    if not hasattr(_get_prompt_instructions, "_text"):
+        with open("prompt_instructions.txt", "r") as f:
+            _get_prompt_instructions._text = f.read()
+    return _get_prompt_instructions._text
 
 """
 ARUGMENTS
@@ -72,6 +103,150 @@ def clean_args(args) -> tuple[str, str, set[str]]:
 READ / COMPILE / RUN (Java)
 """
 
+# Java helper that compiles many projects inside a single JVM (see its javadoc)
+BULK_COMPILE_SRC = Path(__file__).with_name("BulkCompile.java")
+
+# Start (once) the persistent BulkCompile JVM. Returns the Popen handle or
+# None when the helper can't run. The daemon exits on its own when our pipes
+# close at interpreter exit, so no explicit shutdown is needed.
+def _javac_daemon():
+    if not hasattr(_javac_daemon, "_proc"):
+        _javac_daemon._lock = threading.Lock()
+        if shutil.which("java") is None or not BULK_COMPILE_SRC.exists():
+            _javac_daemon._proc = None
+        else:
+            try:
+                # `java BulkCompile.java` uses single-file source launch (JDK 11+)
+                _javac_daemon._proc = subprocess.Popen(
+                    ["java", str(BULK_COMPILE_SRC)],
+                    stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                    text=True, bufsize=1
+                )
+            except Exception as e:
+                print(f"Compile daemon unavailable ({type(e).__name__}: {e}), using per-project javac")
+                _javac_daemon._proc = None
+    return _javac_daemon._proc
+
+# Compile one project through the persistent JVM (one srcRoot\tbuildDir line
+# out, one OK/FAIL line back). Returns ok, or None when the daemon is down so
+# the caller can fall back to spawning javac.
+def daemon_compile(src_root: Path, build_path: Path):
+    proc = _javac_daemon()
+    if proc is None or proc.poll() is not None:
+        return None
+    try:
+        with _javac_daemon._lock:
+            proc.stdin.write(f"{src_root}\t{build_path}\n")
+            proc.stdin.flush()
+            line = proc.stdout.readline()
+    except Exception as e:
+        print(f"Compile daemon request failed ({type(e).__name__}: {e})")
+        return None
+    if not line:
+        return None
+    return line.partition("\t")[0] == "OK"
+
+def bulk_compile(project_dirs: list[Path]) -> bool:
+    """
+    Compile every project up front through the ONE persistent BulkCompile JVM,
+    instead of paying javac startup (~0.5s) once per project. Successful roots
+    are fed into compile_java's memo so the later per-project calls are hits;
+    anything that fails here just falls through to the normal javac path.
+    Returns False when the daemon could not run at all.
+    """
+    if _javac_daemon() is None:
+        return False
+
+    if not hasattr(compile_java, "_compiled_roots"):
+        compile_java._compiled_roots = set()
+    for d in project_dirs:
+        src_root = d.resolve()
+        build_path = (d / ".build").resolve()
+        # unchanged since a previous run: don't even bother the daemon
+        if compile_up_to_date(src_root, build_path):
+            compile_java._compiled_roots.add(src_root)
+            print(f"\t Up to date: {src_root}")
+            continue
+        ok = daemon_compile(src_root, build_path)
+        if ok is None:
+            return False
+        if ok:
+            compile_java._compiled_roots.add(src_root)
+            record_compile_state(src_root, build_path)
+            print(f"\t Bulk compiled: {src_root}")
+    return True
+
+# Newest st_mtime_ns across the .java sources of a project, or 0 if none
+def newest_source_mtime(src_root: Path) -> int:
+    newest = 0
+    for path, _ in walk_filtered(src_root, {".java"}):
+        try:
+            newest = max(newest, os.stat(path).st_mtime_ns)
+        except OSError:
+            continue
+    return newest
+
+# True when .build/state.json matches the current newest source mtime and the
+# compiled classes are still on disk -- nothing changed, so javac can be skipped
+def compile_up_to_date(src_root: Path, build_path: Path) -> bool:
+    try:
+        state = orjson.loads((build_path / "state.json").read_bytes())
+    except Exception:
+        return False
+    if state.get("newest_mtime_ns") != newest_source_mtime(src_root):
+        return False
+    return any(True for _ in walk_filtered(build_path, {".class"}))
+
+# Remember what we just compiled so the next run can skip it
+def record_compile_state(src_root: Path, build_path: Path):
+    try:
+        (build_path / "state.json").write_bytes(
+            orjson.dumps({"newest_mtime_ns": newest_source_mtime(src_root)}))
+    except Exception as e:
+        print(f"\t Failed to write compile state for {src_root}: {e}")
+
+# Recursive directory walk on raw os.scandir: rglob builds a Path object and
+# issues an extra stat per entry, scandir gets type + name from the dirent.
+# Yields (abs_path, suffix) for files whose lowercased suffix is in
+# wanted_suffixes (or every file when wanted_suffixes is None).
+def walk_filtered(root, wanted_suffixes: set[str] = None) -> Iterator[tuple[str, str]]:
+    stack = [str(root)]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file():
+                        dot = entry.name.rfind('.')
+                        suffix = entry.name[dot:].lower() if dot > 0 else ''
+                        if wanted_suffixes is None or suffix in wanted_suffixes:
+                            yield entry.path, suffix
+        except OSError as e:
+            print(f"\t Skip (walk error): {current} ({e})")
+
+# One scandir pass per project: read every file whose suffix is in ext_set into
+# {path: raw bytes}. Memoized so read_code_from_proj, run_java_main and the
+# java-present check all share the same walk instead of re-reading the tree.
+# Kept as bytes so the regex scan runs on the faster byte engine; callers
+# decode only what they actually need.
+@functools.lru_cache(maxsize=None)
+def scan_project(src_root: Path, ext_set: frozenset[str]) -> dict[Path, bytes]:
+    files: dict[Path, bytes] = {}
+    for path, suffix in walk_filtered(src_root, ext_set):
+        f = Path(path)
+        try:
+            # don't slurp giant bundled files that would blow the code
+            # budget anyway; .java is exempt since the main() scan needs it
+            if suffix != ".java" and f.stat().st_size > CODE_BYTE_BUDGET:
+                print(f"\t Skip (too large): {f}")
+                continue
+            files[f] = f.read_bytes()
+        except Exception as e:
+            print(f"\t Skip (read error): {f} ({e})")
+    return files
+
 def compile_java(target: Path, build_path: Path):
     """
     Compile all .java sources under `target` (dir) or under `target.parent` (file)
@@ -81,10 +256,13 @@ def compile_java(target: Path, build_path: Path):
     - Writes classes into a dedicated .build folder to keep submissions clean.
     - Uses an @sources.txt argfile to dodge command-line length limits with many files.
     """
-    # determine src root
+    # determine src root; callers normally hand us already-resolved absolute
+    # paths, so only pay the realpath syscall when one isn't
     src_root = target if target.is_dir() else target.parent
-    src_root = src_root.resolve()
-    build_path = build_path.resolve()
+    if not src_root.is_absolute():
+        src_root = src_root.resolve()
+    if not build_path.is_absolute():
+        build_path = build_path.resolve()
 
     # memoize to avoid recompiling same project
     if not hasattr(compile_java, "_compiled_roots"):
@@ -92,10 +270,29 @@ def compile_java(target: Path, build_path: Path):
     if src_root in compile_java._compiled_roots:
         return True, f"Already compiled: {src_root}", build_path
 
+    # sources unchanged since a previous run and classes still present:
+    # nothing to do
+    if compile_up_to_date(src_root, build_path):
+        compile_java._compiled_roots.add(src_root)
+        return True, f"Up to date: {src_root}", build_path
+
+    # try the persistent compile daemon first; one JVM serves the whole run
+    # (it writes compile.log itself)
+    ok = daemon_compile(src_root, build_path)
+    if ok is not None:
+        if ok:
+            compile_java._compiled_roots.add(src_root)
+            record_compile_state(src_root, build_path)
+        try:
+            out = (build_path / "compile.log").read_text(encoding="utf-8", errors="ignore")
+        except Exception:
+            out = ""
+        return ok, out, build_path
+
     if shutil.which("javac") is None:
         return False, "javac not found on PATH", build_path
 
-    sources = [str(p) for p in src_root.rglob("*.java")]
+    sources = [path for path, _ in walk_filtered(src_root, {".java"})]
     if not sources:
         return False, f"No .java sources under {src_root}", build_path
 
@@ -125,6 +322,7 @@ def compile_java(target: Path, build_path: Path):
     ok = proc.returncode == 0
     if ok:
         compile_java._compiled_roots.add(src_root)
+        record_compile_state(src_root, build_path)
     try:
         (build_path / "compile.log").write_text(out, encoding="utf-8", errors="ignore")
     except Exception:
@@ -132,120 +330,217 @@ def compile_java(target: Path, build_path: Path):
     return ok, out, build_path
 
 # Regexes (thanks chatgpt):
-# - MAIN_RE: supports String[] args or String... args, any var name, and flexible whitespace.
-MAIN_RE = re.compile(
-    r'public\s+static\s+void\s+main\s*\(\s*String(?:\[\]|\.\.\.)\s+\w+\s*\)',
-    re.I
+# One combined alternation with named groups so a single pass per file picks up
+# the package declaration, every class declaration, and the main(...) signature
+# (String[] args or String... args, any var name, flexible whitespace).
+# Byte patterns: sources are scanned as raw bytes so there's no up-front
+# UTF-8 decode and the regex engine runs on the faster byte paths.
+COMBINED_RE = re.compile(
+    rb'(?P<pkg>^\s*package\s+(?P<pkgname>[\w\.]+)\s*;)'
+    rb'|(?P<cls>\b(?P<pub>public\s+)?class\s+(?P<clsname>[A-Za-z_]\w*)\b)'
+    rb'|(?P<main>public\s+static\s+void\s+main\s*\(\s*String(?:\[\]|\.\.\.)\s+\w+\s*\))',
+    re.M
 )
-# - PKG_RE: capture optional package declaration.
-PKG_RE  = re.compile(r'^\s*package\s+([\w\.]+)\s*;\s*$', re.M)
-# - CLASS_RE: capture class declarations; we later map which class encloses the main() hit.
-CLASS_RE = re.compile(r'\b(public\s+)?class\s+([A-Za-z_]\w*)\b', re.M)
 
-def find_java_main_classes(root: Path) -> list[str]:
+def find_java_main_classes(files: dict[Path, bytes]) -> list[str]:
     """
     Return FQCNs by finding the class that **encloses** a main(...) in each file.
     If we can't locate the enclosing class, we fall back to the file stem (or first public class).
+    Takes the pre-read {path: bytes} dict from scan_project instead of re-walking the tree.
     """
     mains: list[str] = []
-    for f in root.rglob('*.java'):
-        try:
-            s = f.read_text(encoding='utf-8', errors='ignore')
-        except Exception:
+    for f, s in files.items():
+        if f.suffix.lower() != '.java':
             continue
 
-        m_main = MAIN_RE.search(s)
-        if not m_main:
+        # cheap guard: no "main" substring means the regex can't hit either
+        if b'main' not in s:
             continue
 
-        # package (optional)
+        # single pass: collect pkg, class spans (start idx, name, public?), first main()
         pkg = None
-        m_pkg = PKG_RE.search(s)
-        if m_pkg:
-            pkg = m_pkg.group(1)
+        class_hits: list[tuple[int, str, bool]] = []
+        main_pos = None
+        for m in COMBINED_RE.finditer(s):
+            if m.group('pkg'):
+                if pkg is None:
+                    # identifiers are ASCII-safe; decode just the capture
+                    pkg = m.group('pkgname').decode('ascii', 'ignore')
+            elif m.group('cls'):
+                class_hits.append((m.start(), m.group('clsname').decode('ascii', 'ignore'), bool(m.group('pub'))))
+            elif main_pos is None:
+                main_pos = m.start()
+
+        if main_pos is None:
+            continue
 
-        # find the class that contains the main() occurrence
-        main_pos = m_main.start()
+        # find the class that contains the main() occurrence;
+        # next class start is end of span
         class_name = None
-
-        # build a list of class spans (start idx, name); next class start is end of span
-        class_hits = list(CLASS_RE.finditer(s))
-        for i, m in enumerate(class_hits):
-            cls_start = m.start()
-            cls_name = m.group(2)
-            cls_end = class_hits[i+1].start() if i+1 < len(class_hits) else len(s)
+        for i, (cls_start, cls_name, _) in enumerate(class_hits):
+            cls_end = class_hits[i+1][0] if i+1 < len(class_hits) else len(s)
             if cls_start <= main_pos < cls_end:
                 class_name = cls_name
                 break
 
         # fallback: first public class, else file stem
         if class_name is None:
-            pub = next((m for m in class_hits if m.group(1)), None)
-            class_name = pub.group(2) if pub else f.stem
+            pub = next((name for _, name, is_public in class_hits if is_public), None)
+            class_name = pub if pub else f.stem
 
         fqcn = f"{pkg}.{class_name}" if pkg else class_name
         mains.append(fqcn)
 
     return mains
 
-def run_java_main(project_path: Path, timeout_s: int = 12) -> dict:
+def run_java_main(project_path: Path, timeout_s: int = 12, files: dict[Path, bytes] = None) -> dict:
     build_dir = (project_path / '.build').resolve()
     if not build_dir.exists():
-        return dict(ok=False, rc=1, stdout='', stderr='Build dir not found', elapsed=0.0, fqcn=None)
+        return dict(ok=False, rc=1, stdout='', stderr='Build dir not found', elapsed=0.0, fqcn=None, truncated=False)
 
-    mains = find_java_main_classes(project_path)
+    if files is None:
+        files = scan_project(project_path.resolve(), frozenset({'.java'}))
+    mains = find_java_main_classes(files)
     if not mains:
-        return dict(ok=False, rc=1, stdout='', stderr='No main() class found', elapsed=0.0, fqcn=None)
+        return dict(ok=False, rc=1, stdout='', stderr='No main() class found', elapsed=0.0, fqcn=None, truncated=False)
 
     fqcn = mains[0]
     t0 = time.time()
     try:
-        proc = subprocess.run(
+        # stream the child's output with bounded buffers: a program stuck in a
+        # print loop gets killed at RUN_OUTPUT_CAP per stream instead of
+        # filling our memory (the cap also means no throwaway giant decode)
+        proc = subprocess.Popen(
             ['java', '-cp', str(build_dir), fqcn],
-            capture_output=True,
-            text=True,
-            timeout=timeout_s,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
             cwd=str(project_path)  # <-- run from project root so relative file paths work
         )
+        bufs = {"out": bytearray(), "err": bytearray()}
+        truncated = False
+        timed_out = False
+        deadline = t0 + timeout_s
+        sel = selectors.DefaultSelector()
+        os.set_blocking(proc.stdout.fileno(), False)
+        os.set_blocking(proc.stderr.fileno(), False)
+        sel.register(proc.stdout, selectors.EVENT_READ, "out")
+        sel.register(proc.stderr, selectors.EVENT_READ, "err")
+        while sel.get_map() and not truncated:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                timed_out = True
+                break
+            for key, _ in sel.select(remaining):
+                chunk = key.fileobj.read(8192)
+                if chunk is None:
+                    continue
+                if chunk == b'':
+                    sel.unregister(key.fileobj)
+                    continue
+                buf = bufs[key.data]
+                space = RUN_OUTPUT_CAP - len(buf)
+                buf += chunk[:space]
+                if len(chunk) > space:
+                    truncated = True
+        sel.close()
+        if truncated or timed_out:
+            proc.kill()
+        try:
+            rc = proc.wait(timeout=max(0.1, deadline - time.time()))
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            rc = proc.wait()
+            timed_out = True
         dt = time.time() - t0
-        print(f"\tOutput:\n{proc.stdout}")
-        return dict(ok=(proc.returncode == 0), rc=proc.returncode,
-                    stdout=proc.stdout or '', stderr=proc.stderr or '',
-                    elapsed=round(dt, 3), fqcn=fqcn)
-    except subprocess.TimeoutExpired:
-        print("\tTimed Out")
-        return dict(ok=False, rc=124, stdout='', stderr='Timeout', elapsed=float(timeout_s), fqcn=fqcn)
+        stdout = bufs["out"].decode(errors="ignore")
+        stderr = bufs["err"].decode(errors="ignore")
+        if timed_out:
+            print("\tTimed Out")
+            return dict(ok=False, rc=124, stdout=stdout, stderr='Timeout',
+                        elapsed=float(timeout_s), fqcn=fqcn, truncated=truncated)
+        print(f"\tOutput:\n{stdout}")
+        if truncated:
+            print(f"\tKilled: output exceeded {RUN_OUTPUT_CAP} bytes")
+        return dict(ok=(rc == 0 and not truncated), rc=rc,
+                    stdout=stdout, stderr=stderr,
+                    elapsed=round(dt, 3), fqcn=fqcn, truncated=truncated)
     except Exception as e:
         print(f"\tException: {e}")
-        return dict(ok=False, rc=1, stdout='', stderr=f'Run failed: {e}', elapsed=0.0, fqcn=fqcn)
+        return dict(ok=False, rc=1, stdout='', stderr=f'Run failed: {e}', elapsed=0.0, fqcn=fqcn, truncated=False)
 
-# Reads all code from the project path (including sub directories) and pastes together as a string
-def read_code_from_proj(projectPath: Path, ext_set: set[str]) -> str:
+# Reads all code from the project path (including sub directories) and pastes together as a string,
+# stopping at byte_budget since trim_length would discard the excess anyway
+def read_code_from_proj(projectPath: Path, ext_set: set[str], byte_budget: int = CODE_BYTE_BUDGET) -> str:
     print(f"\nReading code from {projectPath}")
 
-    code = ""
+    src_root = projectPath.resolve()
+    files = scan_project(src_root, frozenset(ext_set | {".java"}))
+
+    # collect pieces and join once at the end; += on str goes quadratic
+    # when a submission has lots of files
+    parts: list[str] = []
     java_found = False
-    for file in projectPath.rglob("*"):
-        if file.is_file() and file.suffix.lower() in ext_set:
-            try:
-                code += f"\nFile: {file.relative_to(projectPath)}\n"
-                code += file.read_text(encoding="utf-8", errors="ignore")
-                print(f"\t Read: {file.relative_to(projectPath)}")
-            except Exception as e:
-                print(f"\t Skip (read error): {file} ({e})")
+    total = 0
+    for file, text in files.items():
+        if file.suffix.lower() in ext_set:
+            if total >= byte_budget:
+                # budget spent: still record the filename so the AI knows it exists
+                parts.append(f"\nFile: {file.relative_to(src_root)} [content omitted: size budget reached]\n")
+                print(f"\t Omit (budget): {file.relative_to(src_root)}")
+            else:
+                parts.append(f"\nFile: {file.relative_to(src_root)}\n")
+                # decode once, and only for files that made it under the budget
+                parts.append(text.decode("utf-8", errors="ignore"))
+                total += len(text)
+                print(f"\t Read: {file.relative_to(src_root)}")
 
-            if file.suffix.lower() == ".java":
-                java_found = True
+        if file.suffix.lower() == ".java":
+            java_found = True
 
-    # compile Java once per project (if any .java present)
+    # compile Java once per project (if any .java present); src_root is
+    # already resolved, so compile_java skips the realpath syscalls
     if java_found:
-        ok, log, out_dir = compile_java(projectPath, projectPath / ".build")
+        ok, log, out_dir = compile_java(src_root, src_root / ".build")
         status = "OK" if ok else "FAIL"
         print(f"\t Java compile: {status} -> {out_dir}")
         if not ok:
             print(log)
 
-    return code
+    return "".join(parts)
+
+"""
+RESULT CACHE
+"""
+
+# Cached {review, run} results live here, one json per content hash
+CACHE_DIR = Path(".grader_cache")
+
+# Hash everything that influences the result: the student code plus the
+# instruction inputs, so editing the description/expected output/prompt
+# invalidates old entries automatically
+def submission_cache_key(code: str, expectedOutput: str, projDescription: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for part in (code, expectedOutput, projDescription, _get_prompt_instructions()):
+        h.update(part.encode("utf-8", "ignore"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+def load_cached_result(cache_key: str) -> dict:
+    try:
+        return orjson.loads((CACHE_DIR / f"{cache_key}.json").read_bytes())
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Ignoring bad cache entry {cache_key}: {e}")
+        return None
+
+def store_cached_result(cache_key: str, review: dict, run: dict):
+    try:
+        CACHE_DIR.mkdir(exist_ok=True)
+        (CACHE_DIR / f"{cache_key}.json").write_bytes(
+            orjson.dumps({"review": review, "run": run}))
+    except Exception as e:
+        print(f"Failed to write cache entry {cache_key}: {e}")
 
 """
 AI PROMPTING
@@ -263,137 +558,318 @@ def trim_length(s: str, limit: int = 4900) -> str:
 
     return s
 
-# Prompt AI and get the formatted json
-def prompt_ai(code: str, expectedOutput: str, projDescription: str, actualOutput: str) -> str:
+# Create a server-side context cache holding the invariant prompt prefix
+# (instructions + description + expected output) so it is tokenized and billed
+# once per run instead of once per call. Returns the cache name, or None if
+# caching is unavailable (e.g. prefix below the minimum token count).
+async def create_prompt_cache(expectedOutput: str, projDescription: str):
+    try:
+        cache = await _get_client().aio.caches.create(
+            model="gemini-2.5-flash",
+            config={
+                "system_instruction": _get_prompt_instructions(),
+                "contents": [
+                    f"Project Description:\n<START>\n{projDescription}\n<END>",
+                    f"Expected Output:\n<START>\n{expectedOutput}\n<END>"
+                ],
+                "ttl": "3600s"
+            }
+        )
+        print(f"Created prompt cache: {cache.name}")
+        return cache.name
+    except Exception as e:
+        print(f"Prompt cache unavailable ({type(e).__name__}: {e}), sending full prompts")
+        return None
+
+# Prompt AI with a batch of submissions and get one formatted json per id.
+# batch is [(submission_id, code, actualOutput), ...] (up to AI_BATCH_SIZE);
+# the shared instructions/description/expected-output prefix is referenced via
+# the context cache when available (sent inline otherwise) and the model
+# returns a JSON array with one review per submission_id. Reviews come back
+# as already-parsed dicts; no reason to re-serialize just for the caller to
+# parse again.
+async def prompt_ai(batch: list[tuple[str, str, str]], expectedOutput: str, projDescription: str,
+                    cached_content: str = None) -> dict[str, dict]:
     # NOTE: We include Actual Program Output so the reviewer can judge logic vs formatting.
-    code = trim_length(code, 19900)
-    actualOutput = trim_length(actualOutput, 19900)
-    prompt = f"""
-    INSTRUCTIONS:
+    submission_blocks = []
+    for submission_id, code, actualOutput in batch:
+        code = trim_length(code, 19900)
+        actualOutput = trim_length(actualOutput, 19900)
+        submission_blocks.append(f"""
+    Submission: {submission_id}
+
+    Actual Program Output:
     <START>
-    {prompt_instructions}
+    {actualOutput}
     <END>
-    
-    Project Description:
+
+    Student Files: (these are all truncated together with the filename at top)
     <START>
-    {projDescription}
+    {code}
     <END>
-    
-    Expected Output:
+    """)
+
+    directive = f"""
+    You are grading {len(batch)} independent submissions below. Grade each one
+    separately against the same description/expected output. Respond with a
+    JSON array containing exactly one review object per submission; each object
+    must carry a "submission_id" field copied verbatim from the submission.
+    {"".join(submission_blocks)}
+    """
+    config = {
+        # JSON mode makes Gemini emit proper JSON
+        "response_mime_type": "application/json",
+        "temperature": 0
+    }
+    if cached_content:
+        # invariant prefix lives server-side; only send the variable parts
+        prompt = directive
+        config["cached_content"] = cached_content
+    else:
+        prompt = f"""
+    INSTRUCTIONS:
     <START>
-    {expectedOutput}
+    {_get_prompt_instructions()}
     <END>
 
-    Actual Program Output:
+    Project Description:
     <START>
-    {actualOutput}
+    {projDescription}
     <END>
-    
-    Student Files: (these are all truncated together with the filename at top)
+
+    Expected Output:
     <START>
-    {code}
+    {expectedOutput}
     <END>
+    {directive}
     """
-    print("Getting AI feedback...")
+    print(f"Getting AI feedback for {len(batch)} submission(s)...")
     try:
-        resp = client.models.generate_content(
+        resp = await _get_client().aio.models.generate_content(
             model="gemini-2.5-flash",
             contents=prompt,
-            # JSON mode makes Gemini emit proper JSON
-            config={
-                "response_mime_type": "application/json",
-                "temperature": 0
-            }
+            config=config
         )
 
         text = (resp.text or "").strip()
-        data = json.loads(text)
+        data = orjson.loads(text)
         pprint.pprint(text)
-        return json.dumps(data, ensure_ascii=False)
+        # scatter the array back to per-submission review dicts by id
+        reviews = {}
+        for item in data:
+            sid = item.pop("submission_id", None)
+            if sid is not None:
+                reviews[sid] = item
+        # "failed" marks placeholder reviews so they are never memoized
+        missing = {
+            "score": 0.0,
+            "comments": ["AI response missing this submission"],
+            "ai": ["NAN"],
+            "failed": True
+        }
+        return {sid: reviews.get(sid, missing) for sid, _, _ in batch}
     except Exception as e:
         # Catch any expections from api or other
         fallback = {
             "score": 0.0,
             "comments": [f"AI call failed: {type(e).__name__}"],
-            "ai": ["NAN"]
+            "ai": ["NAN"],
+            "failed": True
         }
 
         print(f"Error: {type(e).__name__}: {e}")
-        return json.dumps(fallback, ensure_ascii=False)
+        return {sid: fallback for sid, _, _ in batch}
 
 """
 MAIN
 """
 
-# Entry
-if __name__ == "__main__":
-    args = parse_args()
-    proj_folder = Path(args.folderPath)
+# Prepare one submission folder (read -> compile -> run); the AI review is
+# batched separately in main_async. Blocking javac/java work goes to the
+# thread executor so submissions still overlap.
+async def prepare_submission(sub_project: str, proj_folder: str, extension_list: set[str],
+                             expectedOutput: str, projDescription: str,
+                             executor: ThreadPoolExecutor) -> dict:
+    current_directory = Path(proj_folder).joinpath(sub_project)
+    loop = asyncio.get_running_loop()
+
+    # Read files + compile Java (blocking -> executor)
+    code = await loop.run_in_executor(executor, read_code_from_proj, current_directory, extension_list)
+
+    # Cache hit (same code + same instructions as a previous run) means the
+    # run and the review are already known; skip java and the AI entirely
+    cache_key = submission_cache_key(code, expectedOutput, projDescription)
+    cached = load_cached_result(cache_key)
+    if cached is not None:
+        print(f"\t Cache hit: {sub_project} ({cache_key})")
+        return {
+            "entry": {"submission": sub_project, "review": cached["review"], "run": cached["run"]},
+            "code": code, "actual_out": "", "cache_key": cache_key, "cached": True
+        }
+
+    # Print run info; we prepare data for AI and results.json.
+    # scan_project is a memo hit here: read_code_from_proj already did the walk.
+    files = scan_project(current_directory.resolve(), frozenset(extension_list | {".java"}))
+    actual_out = ""
+    java_present = any(p.suffix.lower() == ".java" for p in files)
+    run_info = None
+    if java_present:
+        java_files = {p: t for p, t in files.items() if p.suffix.lower() == ".java"}
+        run_info = await loop.run_in_executor(
+            executor, functools.partial(run_java_main, current_directory, files=java_files))
+        if run_info.get('fqcn'):
+            print(f"\t Java run: fqcn={run_info['fqcn']}, rc={run_info['rc']}, elapsed={run_info['elapsed']}s")
+        else:
+            print(f"\t Java run: {run_info['stderr']}")
+        actual_out = run_info.get('stdout', '')
+
+    # Assemble entry, including run details (stdout/stderr/rc/time/fqcn);
+    # "review" is filled in after the batched AI phase
+    result_entry = {
+        "submission": sub_project,
+        "review": None,
+        "run": None
+    }
+    if run_info is not None:
+        result_entry["run"] = {
+            "ok": run_info["ok"],
+            "rc": run_info["rc"],
+            "elapsed_sec": run_info["elapsed"],
+            "fqcn": run_info["fqcn"],
+            "stdout": trim_length(run_info.get("stdout",""), 19900),
+            "stderr": trim_length(run_info.get("stderr",""), 5000),
+            "truncated": run_info.get("truncated", False)
+        }
+    return {"entry": result_entry, "code": code, "actual_out": actual_out,
+            "cache_key": cache_key, "cached": False}
+
+# Drive the whole run: one task per submission, gathered concurrently.
+# Entries are streamed into results.json as they finish so nothing is
+# buffered for the whole run and partial results survive a crash.
+async def main_async(args, out_path: Path = Path("results.json")):
+    # resolve the folder once up front; every per-submission path is a cheap
+    # join from here instead of a fresh Path + realpath in the loop
+    proj_folder = Path(args.folderPath).resolve()
     use_ai = args.ai
     # Get cleaned arguments
     expectedOutput, projDescription, extension_list = clean_args(args)
 
-    # start a results container
-    results = {
-        "folderPath": str(proj_folder),
-        "results": []
-    }
-
-    # Look through each sub_project in the project folder
-    for sub_project in os.listdir(proj_folder):
-        current_directory = Path(proj_folder).joinpath(sub_project)
-        if not current_directory.is_dir():
-            print(f"Skipping non-folder entry: {current_directory.name}")
+    # Collect submission folders up front (scandir: dirent type info, no
+    # extra stat per entry)
+    sub_projects = []
+    for entry in os.scandir(proj_folder):
+        if not entry.is_dir():
+            print(f"Skipping non-folder entry: {entry.name}")
             continue
-
-        # Read files + compile Java
-        code = read_code_from_proj(current_directory, extension_list)
-
-        # Print run info; we prepare data for AI and results.json
-        actual_out = ""
-        java_present = any(p.is_file() and p.suffix.lower() == ".java" for p in current_directory.rglob("*"))
-        run_info = None
-        if java_present:
-            run_info = run_java_main(current_directory)
-            if run_info.get('fqcn'):
-                print(f"\t Java run: fqcn={run_info['fqcn']}, rc={run_info['rc']}, elapsed={run_info['elapsed']}s")
+        sub_projects.append(entry.name)
+
+    out = out_path.open("w", encoding="utf-8")
+    out.write(f'{{"folderPath": {orjson.dumps(str(proj_folder)).decode()}, "results": [')
+    entry_count = 0
+
+    # stream one finished entry at a time; flush so a crash keeps what's done
+    def write_entry(entry: dict):
+        nonlocal entry_count
+        out.write(",\n" if entry_count else "\n")
+        out.write(orjson.dumps(entry).decode())
+        out.flush()
+        entry_count += 1
+
+    ai_semaphore = asyncio.Semaphore(AI_CONCURRENCY)
+    with ThreadPoolExecutor(max_workers=available_cpus()) as executor:
+        # Phase 0 - compile every submission in one JVM; the per-project
+        # compile_java calls below then hit the memo. If the helper can't run,
+        # fan the individual javac invocations out across the pool instead
+        # (javac is CPU-bound and subprocess.run releases the GIL)
+        loop = asyncio.get_running_loop()
+        project_dirs = [proj_folder / sp for sp in sub_projects]
+        if not await loop.run_in_executor(executor, bulk_compile, project_dirs):
+            await asyncio.gather(*[
+                loop.run_in_executor(executor, compile_java, d, d / ".build")
+                for d in project_dirs
+            ])
+
+        # catch per-submission failures inline so the pipeline below doesn't
+        # have to map exceptions back to submission names
+        async def prepare_wrapped(sp):
+            try:
+                return await prepare_submission(sp, str(proj_folder), extension_list,
+                                                expectedOutput, projDescription, executor)
+            except Exception as e:
+                print(f"Error grading {sp}: {type(e).__name__}: {e}")
+                return {
+                    "entry": {
+                        "submission": sp,
+                        "review": {"score": 0.0, "comments": [f"Grading failed: {type(e).__name__}"], "ai": ["NAN"]},
+                        "run": None
+                    },
+                    "cached": True  # complete as-is; nothing left to review
+                }
+
+        # the invariant-prefix cache is created lazily by the first AI batch,
+        # so an all-cache-hit run never touches the API
+        cache_lock = asyncio.Lock()
+        cache_state = {}
+
+        async def get_cached_content():
+            async with cache_lock:
+                if "name" not in cache_state:
+                    cache_state["name"] = await create_prompt_cache(expectedOutput, projDescription)
+            return cache_state["name"]
+
+        async def review_batch(chunk):
+            async with ai_semaphore:
+                reviews = await prompt_ai(
+                    [(p["entry"]["submission"], p["code"], p["actual_out"]) for p in chunk],
+                    expectedOutput=expectedOutput,
+                    projDescription=projDescription,
+                    cached_content=await get_cached_content()
+                )
+            for p in chunk:
+                review = reviews[p["entry"]["submission"]]
+                p["entry"]["review"] = review
+                # don't memoize placeholder reviews (call failed or the model
+                # dropped this id from the batch); retry them next run
+                if not review.get("failed"):
+                    store_cached_result(p["cache_key"], review, p["entry"]["run"])
+                write_entry(p["entry"])
+
+        # Pipelined stages: each submission flows compile -> run -> AI on its
+        # own, and as soon as AI_BATCH_SIZE of them clear the run stage a
+        # review batch is dispatched -- so the network is grading earlier
+        # submissions while later ones are still compiling/running. The stages
+        # stay individually bounded: compile/run by the executor, AI by the
+        # semaphore.
+        prepare_tasks = [asyncio.create_task(prepare_wrapped(sp)) for sp in sub_projects]
+        review_tasks = []
+        pending_chunk = []
+        for fut in asyncio.as_completed(prepare_tasks):
+            p = await fut
+            if p["cached"]:
+                # cache hits (and failures) are already complete entries
+                write_entry(p["entry"])
+            elif not use_ai:
+                # SAFETY: fill "review" even when AI is disabled to keep the shape stable.
+                p["entry"]["review"] = {
+                    "Overall score": "N/A",
+                    "Comments": "AI disabled",
+                    "AI": "None"
+                }
+                write_entry(p["entry"])
             else:
-                print(f"\t Java run: {run_info['stderr']}")
-            actual_out = run_info.get('stdout', '')
-
-        # If using ai, prompt with actual output included
-        if use_ai:
-            ai_json = prompt_ai(
-                code=code,
-                expectedOutput=expectedOutput,
-                projDescription=projDescription,
-                actualOutput=actual_out
-            )
-        else:
-            # SAFETY: define ai_json even when AI is disabled to avoid NameError below.
-            ai_json = json.dumps({
-                "Overall score": "N/A",
-                "Comments": "AI disabled",
-                "AI": "None"
-            }, ensure_ascii=False)
-
-        # Assemble entry, including run details (stdout/stderr/rc/time/fqcn)
-        result_entry = {
-            "submission": sub_project,
-            "review": json.loads(ai_json),
-            "run": None
-        }
-        if run_info is not None:
-            result_entry["run"] = {
-                "ok": run_info["ok"],
-                "rc": run_info["rc"],
-                "elapsed_sec": run_info["elapsed"],
-                "fqcn": run_info["fqcn"],
-                "stdout": trim_length(run_info.get("stdout",""), 19900),
-                "stderr": trim_length(run_info.get("stderr",""), 5000)
-            }
-        results["results"].append(result_entry)
+                pending_chunk.append(p)
+                if len(pending_chunk) >= AI_BATCH_SIZE:
+                    review_tasks.append(asyncio.create_task(review_batch(pending_chunk)))
+                    pending_chunk = []
+        if pending_chunk:
+            review_tasks.append(asyncio.create_task(review_batch(pending_chunk)))
+        if review_tasks:
+            await asyncio.gather(*review_tasks)
+
+    out.write("\n]}\n")
+    out.close()
 
+# Entry
+if __name__ == "__main__":
+    asyncio.run(main_async(parse_args()))
     print("Data has been written to results.json")
-    out_path = Path("results.json")
-    out_path.write_text(json.dumps(results, indent=2), encoding="utf-8")